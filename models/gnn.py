@@ -14,6 +14,9 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as f
 
+# spatio-temporal operators sparser than this are stored in CSR layout
+SPARSE_DENSITY_THRESHOLD = 0.2
+
 
 class SPTempGNN(nn.Module):
     """Spatio-temporal graph neural network."""
@@ -26,6 +29,7 @@ class SPTempGNN(nn.Module):
         out_size: int,
         total_nodes: int,
         device: torch.device,
+        sparse: bool = False,
     ) -> None:
         """
         Initialize the SPTempGNN class.
@@ -42,11 +46,15 @@ class SPTempGNN(nn.Module):
         :type total_nodes: int
         :param device: device to use
         :type device: str
+        :param sparse: store the normalized adjacency in CSR layout
+        :type sparse: bool
         """
         super(SPTempGNN, self).__init__()
         self.total_nodes = total_nodes
         self.spatial_temp = torch.mm(
             d_temporal, torch.mm(a_temporal, d_temporal))
+        if sparse:
+            self.spatial_temp = self.spatial_temp.to_sparse_csr()
         self.his_temporal_weight = nn.Parameter(
             nn.init.xavier_uniform_(torch.empty(num_timestamps, out_size))
         ).to(device)
@@ -58,7 +66,8 @@ class SPTempGNN(nn.Module):
         """
         Forward pass of the SPTempGNN class.
 
-        :param his_raw_features: raw features of the history
+        :param his_raw_features: raw features of the history of shape
+            (..., num_timestamps*total_nodes, num_features)
         :type his_raw_features: torch.Tensor
 
         :return: output of the SPTempGNN
@@ -67,13 +76,40 @@ class SPTempGNN(nn.Module):
         his_self = his_raw_features
         his_temporal = self.his_temporal_weight.repeat(
             self.total_nodes, 1) * his_raw_features
-        his_temporal = torch.mm(self.spatial_temp, his_temporal)
-        his_combined = torch.cat([his_self, his_temporal], dim=1)
-        his_final = torch.mm(his_combined, self.his_final_weight)
+        his_temporal = self.aggregate(his_temporal)
+        his_combined = torch.cat([his_self, his_temporal], dim=-1)
+        his_final = torch.matmul(his_combined, self.his_final_weight)
         his_raw_features = f.relu(his_final)
 
         return his_raw_features
 
+    def aggregate(self, features: torch.Tensor) -> torch.Tensor:
+        """
+        Aggregate features over the spatio-temporal adjacency.
+
+        :param features: features of shape
+            (..., num_timestamps*total_nodes, num_features)
+        :type features: torch.Tensor
+
+        :return: aggregated features of the same shape
+        :rtype: torch.Tensor
+        """
+        # branch on the layout so modules pickled before sparse support load
+        if self.spatial_temp.layout != torch.sparse_csr:
+            return torch.matmul(self.spatial_temp, features)
+
+        # sparse @ dense only takes 2D operands, so fold the batch
+        # dimensions into the columns
+        batch_shape = features.shape[:-2]
+        rows, cols = features.shape[-2:]
+        features = features.reshape(-1, rows, cols).transpose(0, 1)
+        features = features.reshape(rows, -1)
+        with torch.autocast(device_type=features.device.type, enabled=False):
+            features = torch.sparse.mm(self.spatial_temp, features.float())
+        features = features.reshape(rows, -1, cols).transpose(0, 1)
+
+        return features.reshape(*batch_shape, rows, cols)
+
 
 class CombinedGNN(nn.Module):
     """Combined spatio-temporal graph neural network."""
@@ -91,9 +127,12 @@ class CombinedGNN(nn.Module):
         """
         Initialize the CombinedGNN class.
 
+        The spatio-temporal operator is assembled densely; when its density
+        is below ``SPARSE_DENSITY_THRESHOLD`` each layer keeps a CSR copy.
+
         :param out_size: output size
         :type out_size: int
-        :param adj_matrix: adjacency matrix
+        :param adj_matrix: adjacency matrix, dense or in CSR layout
         :type adj_matrix: torch.Tensor
         :param device: device to use
         :type device: str
@@ -118,13 +157,9 @@ class CombinedGNN(nn.Module):
         # total nodes (95 in our case)
         self.total_nodes = self.adj_matrix.shape[0]
 
-        self.his_weight = nn.Parameter(
-            nn.init.xavier_uniform_(torch.empty(
-                self.out_size, self.num_timestamps*out_size)))
-        self.cur_weight = nn.Parameter(
-            nn.init.xavier_uniform_(torch.empty(1, self.num_timestamps*1)))
-
         a = self.adj_matrix
+        if a.layout == torch.sparse_csr:
+            a = a.to_dense()
         dim = self.num_timestamps * self.total_nodes
 
         a_temporal = torch.zeros(dim, dim).to(self.device)
@@ -149,6 +184,11 @@ class CombinedGNN(nn.Module):
         for i in range(dim):
             d_temporal[i, i] = 1/max(torch.sqrt(row_sum[i]), torch.tensor(1))
 
+        # d_temporal is a positive diagonal, so the operator
+        # d_temporal @ a_temporal @ d_temporal has the nonzeros of a_temporal
+        density = torch.count_nonzero(a_temporal).item() / a_temporal.numel()
+        self.sparse = density < SPARSE_DENSITY_THRESHOLD
+
         for i in range(self.num_gnn_layers):
             sp_temp_gnn = SPTempGNN(
                 d_temporal,
@@ -157,6 +197,7 @@ class CombinedGNN(nn.Module):
                 self.out_size,
                 self.total_nodes,
                 self.device,
+                self.sparse,
             )
             setattr(self, f'sp_temp_gnn_{i}', sp_temp_gnn)
 
@@ -179,31 +220,31 @@ class CombinedGNN(nn.Module):
         """
         Forward pass of the CombinedGNN class.
 
-        :param his_raw_features: raw features of the history
+        :param his_raw_features: raw features of the history of shape
+            (num_timestamps, total_nodes, num_days) or batched as
+            (batch_size, num_timestamps, total_nodes, num_days)
         :type his_raw_features: torch.Tensor
 
-        :return: output of the CombinedGNN
+        :return: output of the CombinedGNN of shape (total_nodes, out_size),
+            with the same leading batch dimension as the input
         :rtype: torch.Tensor
         """
         dim = self.num_timestamps * self.total_nodes
-        his_raw_features = his_raw_features[:, :, :self.num_days].view(
-            dim, self.num_days)
+        batch_shape = his_raw_features.shape[:-3]
+        his_raw_features = his_raw_features[..., :self.num_days].reshape(
+            *batch_shape, dim, self.num_days)
 
         for i in range(self.num_gnn_layers):
             sp_temp_gnn = getattr(self, f'sp_temp_gnn_{i}')
             his_raw_features = sp_temp_gnn(his_raw_features)
-            # check if the output is nan
-            if torch.isnan(his_raw_features).any():
-                print('nan', i)
-                exit()
 
         his_list = []
 
         for i in range(self.num_timestamps):
             start = i * self.total_nodes
             end = (i+1) * self.total_nodes
-            his_list.append(his_raw_features[start:end, :])
+            his_list.append(his_raw_features[..., start:end, :])
 
-        his_final_embds = torch.cat(his_list, dim=1)
-        final_embds = f.relu(self.final_weight.mm(his_final_embds.t()).t())
+        his_final_embds = torch.cat(his_list, dim=-1)
+        final_embds = f.relu(his_final_embds.matmul(self.final_weight.t()))
         return final_embds
@@ -10,19 +10,21 @@ Classes:
 __author__ = "Mir Sazzat Hossain"
 
 
-import math
 import os
 import pickle
 
 import numpy as np
 import pandas as pd
 import torch
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data.distributed import DistributedSampler
 from torch.utils.tensorboard import SummaryWriter
 from tqdm import tqdm
 
 from models.gnn import CombinedGNN
 from models.regression import Regression
-from utils.tools import calculate_foodwise_errors, mae, mape, rmse
+from utils.tools import calculate_foodwise_errors, compute_metrics
 
 
 class GNNTrainer(object):
@@ -38,11 +40,13 @@ class GNNTrainer(object):
         num_gnn_layers: int,
         epochs: int,
         learning_rate: float,
-        batch_size: int,
         device: torch.device,
         work_dir: str,
         dish_dict_path: str,
         dates_dict_path: str,
+        time_batch_size: int = 8,
+        compile_model: bool = True,
+        amp_dtype: str = "bfloat16",
     ) -> None:
         """
         Initialize the GNNTrainer class.
@@ -63,8 +67,6 @@ class GNNTrainer(object):
         :type epochs: int
         :param learning_rate: learning rate
         :type learning_rate: float
-        :param batch_size: batch size
-        :type batch_size: int
         :param device: device
         :type device: str
         :param work_dir: working directory
@@ -73,6 +75,16 @@ class GNNTrainer(object):
         :type dish_dict_path: str
         :param dates_dict_path: path to the dates dictionary
         :type dates_dict_path: str
+        :param time_batch_size: number of timestamps per optimizer step
+        :type time_batch_size: int
+        :param compile_model: compile the training forward pass with
+            torch.compile
+        :type compile_model: bool
+        :param amp_dtype: autocast dtype for training on CUDA, "bfloat16",
+            "float16" or None to train in full precision
+        :type amp_dtype: str
+
+        :raises ValueError: if amp_dtype is not supported by the device
         """
         super(GNNTrainer, self).__init__()
         self.train_data = train_data
@@ -92,16 +104,15 @@ class GNNTrainer(object):
         self.dish_dict_path = dish_dict_path
         self.dates_dict_path = dates_dict_path
 
-        self.all_nodes = [i for i in range(self.adj_matrix.shape[0])]
-        self.node_batch_size = batch_size
+        self.time_batch_size = time_batch_size
 
-        self.train_data = torch.Tensor(self.train_data).to(self.device)
-        self.train_labels = torch.Tensor(
-            self.train_labels).to(self.device)
-        self.test_data = torch.Tensor(self.test_data).to(self.device)
-        self.test_labels = torch.Tensor(self.test_labels).to(self.device)
-        self.adj_matrix = torch.Tensor(self.adj_matrix).to(self.device)
-        self.all_nodes = torch.LongTensor(self.all_nodes).to(self.device)
+        self.train_data = self._to_device(self.train_data)
+        self.train_labels = self._to_device(self.train_labels)
+        self.test_data = self._to_device(self.test_data)
+        self.test_labels = self._to_device(self.test_labels)
+        self.adj_matrix = self._to_device(self.adj_matrix)
+        self.all_nodes = torch.arange(
+            self.adj_matrix.shape[0], device=self.device)
 
         self.time_stamp_model = CombinedGNN(
             self.output_size,
@@ -121,11 +132,105 @@ class GNNTrainer(object):
         self.time_stamp_model.to(self.device)
         self.regression_model.to(self.device)
 
+        # each rank trains on its own shard of the timestamps and the
+        # gradients are all-reduced by DistributedDataParallel
+        self.distributed = dist.is_available() and dist.is_initialized()
+        self.rank = dist.get_rank() if self.distributed else 0
+        self.sampler = None
+        if self.distributed:
+            device_ids = [self.device.index] \
+                if self.device.type == "cuda" else None
+            self.time_stamp_model = DistributedDataParallel(
+                self.time_stamp_model, device_ids=device_ids)
+            self.regression_model = DistributedDataParallel(
+                self.regression_model, device_ids=device_ids)
+            self.sampler = DistributedSampler(
+                range(len(self.train_data)), shuffle=True)
+
+        self._fwd = self._forward
+        # inductor does not support sparse tensors, keep sparse graphs eager
+        if compile_model and not self._unwrap(self.time_stamp_model).sparse:
+            # DDP splits the graph at its bucket boundaries
+            self._fwd = torch.compile(
+                self._forward,
+                mode="reduce-overhead",
+                fullgraph=not self.distributed,
+            )
+
+        self.parameters = [
+            param
+            for model in (self.time_stamp_model, self.regression_model)
+            for param in model.parameters()
+            if param.requires_grad
+        ]
+        self.optimizer = torch.optim.Adam(
+            self.parameters, lr=self.learning_rate, weight_decay=0)
+        self._mse = torch.nn.MSELoss()
+
+        if amp_dtype not in (None, "bfloat16", "float16"):
+            raise ValueError(f"Unsupported amp_dtype: {amp_dtype}")
+        self.use_amp = amp_dtype is not None and self.device.type == "cuda"
+        if self.use_amp and amp_dtype == "bfloat16" and \
+                not torch.cuda.is_bf16_supported():
+            raise ValueError(
+                "The CUDA device does not support bfloat16, "
+                "set amp_dtype to \"float16\" or None")
+        self.amp_dtype = getattr(torch, amp_dtype) if self.use_amp else None
+        # loss scaling is only needed for float16, bfloat16 keeps the range
+        self.scaler = torch.cuda.amp.GradScaler(
+            enabled=self.amp_dtype == torch.float16)
+        self._train_loss_buf = torch.zeros((), device=self.device)
+
         self.log_dir = None
         self.run_version = None
         self.writer = None
         self.run_version = None
 
+        self._inv_dish_dict = None
+        self._dates = None
+
+    def _to_device(self, data: torch.Tensor) -> torch.Tensor:
+        """
+        Move data to the trainer device as a float32 tensor.
+
+        :param data: tensor or array to move
+        :type data: torch.Tensor
+
+        :return: float32 tensor on the trainer device
+        :rtype: torch.Tensor
+        """
+        data = torch.as_tensor(data, dtype=torch.float32)
+        if self.device.type == "cuda" and data.device.type == "cpu":
+            data = data.pin_memory()
+        return data.to(self.device, non_blocking=True)
+
+    @staticmethod
+    def _unwrap(model: torch.nn.Module) -> torch.nn.Module:
+        """
+        Return the underlying module of a DistributedDataParallel wrapper.
+
+        :param model: model, possibly wrapped
+        :type model: torch.nn.Module
+
+        :return: unwrapped model
+        :rtype: torch.nn.Module
+        """
+        if isinstance(model, DistributedDataParallel):
+            return model.module
+        return model
+
+    def _load_lookup_tables(self) -> None:
+        """Load the dish and dates dictionaries once and cache them."""
+        if self._inv_dish_dict is not None:
+            return
+
+        with open(self.dish_dict_path, "rb") as f:
+            dish_dict = pickle.load(f)
+        self._inv_dish_dict = {v: k for k, v in dish_dict.items()}
+
+        with open(self.dates_dict_path, "rb") as f:
+            self._dates = list(pickle.load(f).keys())
+
     def initiate_writer(self) -> None:
         """Initiate the writer."""
         self.log_dir = self.work_dir + "/logs"
@@ -139,85 +244,92 @@ class GNNTrainer(object):
         self.log_dir = os.path.join(self.log_dir, f"run_{self.run_version}")
         self.writer = SummaryWriter(self.log_dir)
 
+    def _forward(self, data: torch.Tensor) -> torch.Tensor:
+        """
+        Run the GNN and the regression head.
+
+        :param data: input of shape
+            (batch_size, num_timestamps, total_nodes, input_size)
+        :type data: torch.Tensor
+
+        :return: logits of shape (batch_size, total_nodes, pred_len)
+        :rtype: torch.Tensor
+        """
+        return self.regression_model(self.time_stamp_model(data))
+
     def train(self) -> None:
         """Train the model."""
-        self.initiate_writer()
+        if self.rank == 0:
+            self.initiate_writer()
 
         min_rmse = float("Inf")
         min_mae = float("Inf")
         min_mape = float("Inf")
         best_test = float("Inf")
 
-        train_loss = torch.tensor(0.0).to(self.device)
-        loop = tqdm(range(1, self.epochs))
+        loop = tqdm(range(1, self.epochs), disable=self.rank != 0)
         for epoch in loop:
             total_timestamp = len(self.train_data)
-            indices = torch.randperm(total_timestamp)
-
-            for index in indices:
-                data = self.train_data[index]
-                labels = self.train_labels[index]
-
-                models = [self.time_stamp_model, self.regression_model]
-                parameters = []
-                for model in models:
-                    for param in model.parameters():
-                        if param.requires_grad:
-                            parameters.append(param)
-
-                optimizer = torch.optim.Adam(
-                    parameters, lr=self.learning_rate, weight_decay=0)
-
-                optimizer.zero_grad()
-                for model in models:
-                    model.zero_grad()
-
-                num_node_batches = math.ceil(
-                    len(self.all_nodes) / self.node_batch_size)
-
-                node_batch_loss = torch.tensor(0.0).to(self.device)
-                for batch in range(num_node_batches):
-                    nodes_in_batch = self.all_nodes[
-                        batch * self.node_batch_size:(batch + 1) *
-                        self.node_batch_size
-                    ]
-                    nodes_in_batch = nodes_in_batch.view(
-                        nodes_in_batch.shape[0], 1)
-                    labels_in_batch = labels[nodes_in_batch]
-                    labels_in_batch = labels_in_batch.view(
-                        len(nodes_in_batch), self.pred_len
-                    )
-                    embeddings = self.time_stamp_model(data)
-                    logits = self.regression_model(embeddings)
-                    loss = torch.nn.MSELoss()(logits, labels_in_batch)
-                    node_batch_loss += loss/(len(nodes_in_batch))
-
-                train_loss += node_batch_loss.item()
-
-                node_batch_loss.backward()
-                for model in models:
-                    torch.nn.utils.clip_grad_norm_(model.parameters(), 5)
-                optimizer.step()
-
-                optimizer.zero_grad()
-                for model in models:
-                    model.zero_grad()
-
-            train_loss = train_loss / len(indices)
+            if self.sampler is not None:
+                self.sampler.set_epoch(epoch)
+                indices = torch.tensor(list(self.sampler), device=self.device)
+            else:
+                indices = torch.randperm(total_timestamp, device=self.device)
+            data_batches = self.train_data.index_select(0, indices).split(
+                self.time_batch_size)
+            label_batches = self.train_labels.index_select(
+                0, indices).split(self.time_batch_size)
+
+            self.time_stamp_model.train()
+            self.regression_model.train()
+            self._train_loss_buf.zero_()
+            for data, labels in zip(data_batches, label_batches):
+                self.optimizer.zero_grad(set_to_none=True)
+
+                with torch.autocast(
+                    device_type=self.device.type,
+                    dtype=self.amp_dtype,
+                    enabled=self.use_amp,
+                ):
+                    logits = self._fwd(data).reshape(-1, self.pred_len)
+                    labels = labels.reshape(-1, self.pred_len)
+                    loss = self._mse(logits, labels)
+                    loss = loss/len(self.all_nodes)
+
+                # weight by batch size so a short last batch is not
+                # over-counted in the per-timestamp mean
+                self._train_loss_buf += loss.detach() * len(data)
+
+                self.scaler.scale(loss).backward()
+                self.scaler.unscale_(self.optimizer)
+                torch.nn.utils.clip_grad_norm_(self.parameters, max_norm=5.0)
+                self.scaler.step(self.optimizer)
+                self.scaler.update()
+
             if epoch <= 24 and epoch % 8 == 0:
                 self.learning_rate = self.learning_rate / 2
             else:
                 self.learning_rate = 0.0001
+            for param_group in self.optimizer.param_groups:
+                param_group["lr"] = self.learning_rate
+
+            num_samples = torch.tensor(
+                float(len(indices)), device=self.device)
+            if self.distributed:
+                dist.all_reduce(self._train_loss_buf)
+                dist.all_reduce(num_samples)
 
+            if self.rank != 0:
+                continue
+
+            _train_loss = self._train_loss_buf.item() / num_samples.item()
             loop.set_description(f"Epoch {epoch}/{self.epochs-1}")
-            loop.set_postfix(loss=train_loss.item())
+            loop.set_postfix(loss=_train_loss)
 
-            self.writer.add_scalar("Loss/train", train_loss, epoch)
+            self.writer.add_scalar("Loss/train", _train_loss, epoch)
 
             labels, pred, _eval_loss = self.evaluate()
-            _rmse = rmse(labels, pred)
-            _mae = mae(labels, pred)
-            _mape = mape(labels, pred)
+            _rmse, _mae, _mape = compute_metrics(labels, pred)
 
             self.writer.add_scalar("Loss/validation", _eval_loss, epoch)
             self.writer.add_scalar("RMSE/validation", _rmse, epoch)
@@ -236,47 +348,48 @@ class GNNTrainer(object):
             self.writer.add_scalar("Evaluation/Min_MAE", min_mae, epoch)
             self.writer.add_scalar("Evaluation/Min_MAPE", min_mape, epoch)
 
-        self.writer.close()
+        if self.rank == 0:
+            self.writer.close()
 
     def evaluate(self) -> tuple:
         """
         Evaluate the model.
 
-        :return: tuple of labels, predictions and loss
+        :return: tuple of labels, predictions of shape
+            (num_timestamps*total_nodes, pred_len) and loss
         :rtype: tuple
         """
         pred = []
         labels = []
-        total_timestamp = len(self.test_data)
-        indices = torch.randperm(total_timestamp)
-
-        total_loss = torch.tensor(0.0).to(self.device)
-        for index in indices:
-            data = self.test_data[index]
-            label = self.test_labels[index]
-
-            models = [self.time_stamp_model, self.regression_model]
-            parameters = []
-
-            for model in models:
-                for param in model.parameters():
-                    if param.requires_grad:
-                        param.requires_grad = False
-                        parameters.append(param)
-
-            embading = self.time_stamp_model(data)
-            logits = self.regression_model(embading)
-            loss = torch.nn.MSELoss()(logits, label)
-            loss = loss/len(self.all_nodes)
-            total_loss += loss.item()
-
-            labels = labels + label.detach().tolist()
-            pred = pred + logits.detach().tolist()
-
-            for param in parameters:
-                param.requires_grad = True
-
-        total_loss = total_loss / len(indices)
+        data_batches = self.test_data.split(self.time_batch_size)
+        label_batches = self.test_labels.split(self.time_batch_size)
+
+        # evaluate in full precision, bfloat16 logits would round the
+        # predictions fed to the metrics and the saved csv files
+        with torch.inference_mode():
+            total_loss = torch.tensor(0.0).to(self.device)
+            # only rank 0 evaluates, so bypass the DDP wrappers and their
+            # collectives; this is also the eager path, CUDA graph replays
+            # would overwrite the compiled outputs accumulated here
+            time_stamp_model = self._unwrap(self.time_stamp_model)
+            regression_model = self._unwrap(self.regression_model)
+            time_stamp_model.eval()
+            regression_model.eval()
+
+            for data, label in zip(data_batches, label_batches):
+                logits = regression_model(time_stamp_model(data)).reshape(
+                    -1, self.pred_len)
+                label = label.reshape(-1, self.pred_len)
+                loss = self._mse(logits, label)
+                loss = loss/len(self.all_nodes)
+                total_loss += loss * len(data)
+
+                labels.append(label.detach())
+                pred.append(logits.detach())
+
+        total_loss = total_loss.item() / len(self.test_data)
+        labels = torch.cat(labels, dim=0).cpu().numpy()
+        pred = torch.cat(pred, dim=0).cpu().numpy()
 
         return labels, pred, total_loss
 
@@ -299,56 +412,48 @@ class GNNTrainer(object):
         self.load_model(model_path)
 
         labels, pred, _eval_loss = self.evaluate()
+        num_foods = len(self.all_nodes)
 
-        _rmse, _mse = calculate_foodwise_errors(
-            labels, pred, len(self.all_nodes))
+        # (num_batches*num_foods, pred_len) -> (num_foods, -1)
+        pred_arr = pred.reshape(-1, num_foods, self.pred_len).transpose(
+            1, 0, 2).reshape(num_foods, -1)
+        labels_arr = labels.reshape(-1, num_foods, self.pred_len).transpose(
+            1, 0, 2).reshape(num_foods, -1)
 
-        # get dish dictionary.pkl file
-        with open(self.dish_dict_path, "rb") as f:
-            dish_dict = pickle.load(f)
+        _rmse, _mae = calculate_foodwise_errors(
+            labels, pred, num_foods)
 
-        # get dish name from dish id
-        dish_name = []
-        for dish_id in self.all_nodes:
-            dish_name.append(
-                list(dish_dict.keys())[list(dish_dict.values()).index(dish_id)]
-            )
+        self._load_lookup_tables()
 
-        # get dates from dates_dict.pkl file
-        with open(self.dates_dict_path, "rb") as f:
-            dates_dict = pickle.load(f)
+        # get dish name from dish id
+        dish_name = [self._inv_dish_dict[i] for i in self.all_nodes.tolist()]
 
         # get date from date id
-        date = list(dates_dict.keys())
-
-        df_pred = pd.DataFrame(columns=["Date"] + dish_name)
-        df_actual = pd.DataFrame(columns=["Date"] + dish_name)
+        date = self._dates
 
         end = len(date)
         end = len(pred[0]) * (end // len(pred[0]))
+        dates = date[test_start + num_days:end+1]
 
-        df_pred["Date"] = date[test_start + num_days:end+1]
-        df_actual["Date"] = date[test_start + num_days:end+1]
-
-        for i in range(len(dish_name)):
-            _food = pred[i::len(dish_name)]
-            _food = [j for i in _food for j in i]
-            df_pred[dish_name[i]] = _food
-
-            _food = labels[i::len(dish_name)]
-            _food = [j for i in _food for j in i]
-            df_actual[dish_name[i]] = _food
+        df_pred = pd.DataFrame({
+            "Date": dates,
+            **{dish_name[i]: pred_arr[i] for i in range(len(dish_name))},
+        })
+        df_actual = pd.DataFrame({
+            "Date": dates,
+            **{dish_name[i]: labels_arr[i] for i in range(len(dish_name))},
+        })
 
         # save the dataframe
         df_pred.to_csv(self.log_dir + "/prediction.csv", index=False)
         df_actual.to_csv(self.log_dir + "/actual.csv", index=False)
 
-        # add dish name and save the rmse and mse
+        # add dish name and save the rmse and mae
         df = pd.DataFrame()
         df["dish_name"] = dish_name
         df["rmse"] = _rmse
-        df["mse"] = _mse
-        df.to_csv(self.log_dir + "/rmse_mse.csv", index=False)
+        df["mae"] = _mae
+        df.to_csv(self.log_dir + "/rmse_mae.csv", index=False)
 
     def load_model(self, model_path: str) -> None:
         """
@@ -379,10 +484,10 @@ class GNNTrainer(object):
     def save_model(self) -> None:
         """Save the model."""
         torch.save(
-            self.time_stamp_model,
+            self._unwrap(self.time_stamp_model),
             os.path.join(self.log_dir, "time_stamp_model.pth")
         )
         torch.save(
-            self.regression_model,
+            self._unwrap(self.regression_model),
             os.path.join(self.log_dir, "regression_model.pth")
         )
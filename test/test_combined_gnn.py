@@ -7,10 +7,11 @@ __author__ = "Mir Sazzat Hossain"
 
 import random
 import unittest
+from unittest import mock
 
 import torch
 
-from models.gnn import CombinedGNN
+from models.gnn import SPARSE_DENSITY_THRESHOLD, CombinedGNN
 
 
 class TestCombinedGNN(unittest.TestCase):
@@ -54,6 +55,57 @@ class TestCombinedGNN(unittest.TestCase):
 
         self.assertEqual(embds.shape, (self.total_nodes, self.out_size))
 
+    def test_forward_batched(self) -> None:
+        """Test the forward method with a batch of timestamps."""
+        historical_raw_features = torch.rand(
+            self.total_data, self.num_timestamps,
+            self.total_nodes, self.num_days).to(self.device)
+
+        embds = self.combined_gnn(historical_raw_features)
+
+        self.assertEqual(
+            embds.shape, (self.total_data, self.total_nodes, self.out_size))
+        self.assertTrue(torch.allclose(
+            embds[0], self.combined_gnn(historical_raw_features[0]),
+            atol=1e-5))
+
+    def test_forward_sparse(self) -> None:
+        """Test the forward method with a CSR adjacency matrix."""
+        adj_matrix = torch.eye(self.total_nodes).to(self.device)
+        gnns = []
+        # a zero threshold keeps the identity operator dense
+        for adj, threshold in (
+            (adj_matrix, 0.0),
+            (adj_matrix.to_sparse_csr(), SPARSE_DENSITY_THRESHOLD),
+        ):
+            torch.manual_seed(0)
+            with mock.patch("models.gnn.SPARSE_DENSITY_THRESHOLD", threshold):
+                gnn = CombinedGNN(
+                    self.out_size,
+                    adj,
+                    self.device,
+                    self.start_time,
+                    self.num_gnn_layers,
+                    self.num_timestamps,
+                    self.num_days,
+                )
+            gnns.append(gnn.to(self.device))
+        dense_gnn, sparse_gnn = gnns
+
+        self.assertFalse(dense_gnn.sparse)
+        self.assertTrue(sparse_gnn.sparse)
+        self.assertEqual(
+            sparse_gnn.sp_temp_gnn_0.spatial_temp.layout, torch.sparse_csr)
+
+        historical_raw_features = torch.rand(
+            self.total_data, self.num_timestamps,
+            self.total_nodes, self.num_days).to(self.device)
+
+        self.assertTrue(torch.allclose(
+            sparse_gnn(historical_raw_features),
+            dense_gnn(historical_raw_features),
+            atol=1e-4))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -53,6 +53,35 @@ class TestSPTempGNN(unittest.TestCase):
         self.assertEqual(output.shape, (self.total_nodes, self.out_size),
                          msg="Test failed for SPTempGNN!")
 
+    def test_forward_sparse(self) -> None:
+        """Test the forward method with a CSR adjacency matrix."""
+        sparse_gnn = SPTempGNN(
+            self.D_temporal,
+            self.A_temporal,
+            self.num_timestamps,
+            self.out_size,
+            self.total_nodes,
+            self.device,
+            sparse=True,
+        )
+        sparse_gnn.his_temporal_weight = self.sp_temp_gnn.his_temporal_weight
+        sparse_gnn.his_final_weight = self.sp_temp_gnn.his_final_weight
+
+        historical_raw_features = torch.rand(
+            self.total_data, self.total_nodes, self.num_days).to(self.device)
+        dense_input = historical_raw_features.clone().requires_grad_()
+        sparse_input = historical_raw_features.clone().requires_grad_()
+
+        dense_output = self.sp_temp_gnn(dense_input)
+        sparse_output = sparse_gnn(sparse_input)
+        self.assertTrue(torch.allclose(
+            sparse_output, dense_output, atol=1e-4))
+
+        dense_output.sum().backward()
+        sparse_output.sum().backward()
+        self.assertTrue(torch.allclose(
+            sparse_input.grad, dense_input.grad, atol=1e-4))
+
 
 if __name__ == '__main__':
     unittest.main()
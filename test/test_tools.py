@@ -6,7 +6,8 @@ __author__ = "Mir Sazzat Hossain"
 
 import unittest
 
-from utils.tools import mae, mape, rmse
+from utils.tools import (calculate_foodwise_errors, compute_metrics, mae,
+                         mape, rmse)
 
 
 class TestTools(unittest.TestCase):
@@ -30,6 +31,23 @@ class TestTools(unittest.TestCase):
         """Test the root mean squared error."""
         self.assertAlmostEqual(rmse(self.y_true, self.y_pred), 0.2)
 
+    def test_compute_metrics(self):
+        """Test the combined RMSE, MAE and MAPE."""
+        _rmse, _mae, _mape = compute_metrics(self.y_true, self.y_pred)
+        self.assertAlmostEqual(_rmse, rmse(self.y_true, self.y_pred))
+        self.assertAlmostEqual(_mae, mae(self.y_true, self.y_pred))
+        self.assertAlmostEqual(_mape, mape(self.y_true, self.y_pred))
+
+    def test_calculate_foodwise_errors(self):
+        """Test the per food RMSE and MAE."""
+        y_true = [[1, 1], [2, 2], [3, 3], [4, 4]]
+        y_pred = [[2, 2], [2, 2], [2, 2], [4, 4]]
+        _rmse, _mae = calculate_foodwise_errors(y_true, y_pred, 2)
+
+        for i in range(2):
+            self.assertAlmostEqual(_rmse[i], rmse(y_true[i::2], y_pred[i::2]))
+            self.assertAlmostEqual(_mae[i], mae(y_true[i::2], y_pred[i::2]))
+
 
 if __name__ == '__main__':
     unittest.main()
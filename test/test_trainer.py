@@ -4,10 +4,19 @@
 
 __author__ = "Mir Sazzat Hossain"
 
+import os
+import pickle
+import tempfile
 import unittest
+from unittest import mock
 
+import numpy as np
+import pandas as pd
 import torch
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
 
+from models.gnn import SPARSE_DENSITY_THRESHOLD
 from models.trainer import GNNTrainer
 from utils.config import load_config
 from utils.data import DataCenter, DataLoader
@@ -68,7 +77,9 @@ class TestTrainer(unittest.TestCase):
             self.config["exp_params"]["device"]
         )
         self.work_dir = self.config["logging_params"]["work_dir"]
-        self.batch_size = self.config["exp_params"]["batch_size"]
+        self.time_batch_size = self.config["exp_params"]["time_batch_size"]
+        self.compile_model = self.config["exp_params"]["compile"]
+        self.amp_dtype = self.config["exp_params"]["amp_dtype"]
         self.dish_dict_path = self.config["data_params"]["dish_dict_path"]
         self.dates_dict_path = self.config["data_params"]["dates_dict_path"]
 
@@ -81,11 +92,13 @@ class TestTrainer(unittest.TestCase):
             self.num_gnn_layers,
             10,  # self.epochs,
             self.learning_rate,
-            self.batch_size,
             self.device,
             self.work_dir,
             self.dish_dict_path,
             self.dates_dict_path,
+            self.time_batch_size,
+            self.compile_model,
+            self.amp_dtype,
         )
 
     def test_train(self):
@@ -103,5 +116,174 @@ class TestTrainer(unittest.TestCase):
         )
 
 
+def build_trainer(
+    work_dir: str,
+    adj_matrix: np.ndarray,
+    compile_model: bool = False,
+    dish_dict_path: str = None,
+    dates_dict_path: str = None,
+) -> GNNTrainer:
+    """Build a trainer on small random data."""
+    num_nodes, num_features, pred_len = adj_matrix.shape[0], 14, 7
+    return GNNTrainer(
+        torch.rand(12, 1, num_nodes, num_features),
+        torch.rand(12, num_nodes, pred_len),
+        torch.rand(6, 1, num_nodes, num_features),
+        torch.rand(6, num_nodes, pred_len),
+        adj_matrix,
+        2,
+        3,
+        0.001,
+        torch.device("cpu"),
+        work_dir,
+        dish_dict_path,
+        dates_dict_path,
+        4,
+        compile_model,
+        None,
+    )
+
+
+class TestDistributedTrainer(unittest.TestCase):
+    """Test the trainer under a single process DDP group."""
+
+    def setUp(self):
+        """Set up the test."""
+        self.work_dir = tempfile.TemporaryDirectory()
+        dist.init_process_group(
+            "gloo",
+            init_method="file://" + os.path.join(
+                self.work_dir.name, "dist_init"),
+            rank=0,
+            world_size=1,
+        )
+        self.trainer = build_trainer(
+            self.work_dir.name, np.random.randint(0, 2, (10, 10)))
+
+    def tearDown(self):
+        """Tear down the test."""
+        dist.destroy_process_group()
+        self.work_dir.cleanup()
+
+    def test_train(self):
+        """Test the train method over several optimizer steps."""
+        self.assertIsInstance(
+            self.trainer.time_stamp_model, DistributedDataParallel)
+        self.assertIsInstance(
+            self.trainer.regression_model, DistributedDataParallel)
+
+        self.trainer.train()
+
+        self.assertTrue(os.path.exists(
+            os.path.join(self.trainer.log_dir, "time_stamp_model.pth")))
+
+
+class TestSparseTrainer(unittest.TestCase):
+    """Test the trainer with a sparse adjacency matrix."""
+
+    def setUp(self):
+        """Set up the test."""
+        self.work_dir = tempfile.TemporaryDirectory()
+        self.trainer = build_trainer(
+            self.work_dir.name, np.eye(10), compile_model=True)
+
+    def tearDown(self):
+        """Tear down the test."""
+        self.work_dir.cleanup()
+
+    def test_sparse_adjacency(self):
+        """Test the CSR conversion and that compilation is skipped."""
+        self.assertTrue(self.trainer.time_stamp_model.sparse)
+        self.assertEqual(
+            self.trainer.time_stamp_model.sp_temp_gnn_0.spatial_temp.layout,
+            torch.sparse_csr)
+        self.assertEqual(self.trainer._fwd, self.trainer._forward)
+
+    def test_train(self):
+        """Test the train method through the sparse aggregation."""
+        self.trainer.train()
+
+        # a checkpoint is only saved for a finite validation loss
+        self.assertTrue(os.path.exists(
+            os.path.join(self.trainer.log_dir, "time_stamp_model.pth")))
+
+    def test_matches_dense(self):
+        """Test that the sparse and dense trainers predict the same."""
+        trainers = []
+        for threshold in (SPARSE_DENSITY_THRESHOLD, 0.0):
+            torch.manual_seed(0)
+            with mock.patch("models.gnn.SPARSE_DENSITY_THRESHOLD", threshold):
+                trainers.append(build_trainer(self.work_dir.name, np.eye(10)))
+        sparse_trainer, dense_trainer = trainers
+        self.assertTrue(sparse_trainer.time_stamp_model.sparse)
+        self.assertFalse(dense_trainer.time_stamp_model.sparse)
+
+        _, sparse_pred, sparse_loss = sparse_trainer.evaluate()
+        _, dense_pred, dense_loss = dense_trainer.evaluate()
+
+        np.testing.assert_allclose(sparse_pred, dense_pred, atol=1e-4)
+        self.assertAlmostEqual(sparse_loss, dense_loss, places=4)
+
+
+class TestTrainerOutputs(unittest.TestCase):
+    """Test the files written by the test method."""
+
+    def setUp(self):
+        """Set up the test."""
+        self.work_dir = tempfile.TemporaryDirectory()
+        self.num_foods = 10
+        self.dish_name = [f"dish_{i}" for i in range(self.num_foods)]
+        # 6 test timestamps with 7 days of predictions each
+        self.dates = [f"day_{i}" for i in range(42)]
+
+        self.dish_dict_path = os.path.join(self.work_dir.name, "dish.pkl")
+        with open(self.dish_dict_path, "wb") as f:
+            pickle.dump({name: i for i, name in enumerate(self.dish_name)}, f)
+        self.dates_dict_path = os.path.join(self.work_dir.name, "dates.pkl")
+        with open(self.dates_dict_path, "wb") as f:
+            pickle.dump({date: i for i, date in enumerate(self.dates)}, f)
+
+        self.trainer = build_trainer(
+            self.work_dir.name,
+            np.random.randint(0, 2, (self.num_foods, self.num_foods)),
+            dish_dict_path=self.dish_dict_path,
+            dates_dict_path=self.dates_dict_path,
+        )
+
+    def tearDown(self):
+        """Tear down the test."""
+        self.work_dir.cleanup()
+
+    def test_test(self):
+        """Test the prediction and actual csv files."""
+        labels, pred, _ = self.trainer.evaluate()
+        self.trainer.test(0, None, 0)
+
+        for file_name, values in (
+            ("prediction.csv", pred),
+            ("actual.csv", labels),
+        ):
+            df = pd.read_csv(os.path.join(self.trainer.log_dir, file_name))
+            self.assertEqual(list(df.columns), ["Date"] + self.dish_name)
+            self.assertEqual(list(df["Date"]), self.dates)
+            for i in range(self.num_foods):
+                _food = values[i::self.num_foods]
+                _food = [j for i in _food for j in i]
+                np.testing.assert_allclose(
+                    df[self.dish_name[i]], _food, rtol=1e-6)
+
+        df = pd.read_csv(os.path.join(self.trainer.log_dir, "rmse_mae.csv"))
+        self.assertEqual(list(df["dish_name"]), self.dish_name)
+
+    def test_test_caches_lookup_tables(self):
+        """Test that a second call reuses the loaded dictionaries."""
+        self.trainer.test(0, None, 0)
+        self.trainer.save_model()
+        os.remove(self.dish_dict_path)
+        os.remove(self.dates_dict_path)
+
+        self.trainer.test(0, self.trainer.log_dir, 0)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -9,10 +9,13 @@ This script trains the USTGCN model on the order prediction task.
 __author__ = "Mir Sazzat Hossain"
 
 import argparse
+import os
 import random
 
 import numpy as np
 import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
 
 from models.trainer import GNNTrainer
 from utils.config import load_config
@@ -32,34 +35,31 @@ def set_seed(seed: int) -> None:
     torch.cuda.manual_seed_all(seed)
 
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser()
-    parser.add_argument(
-        "--seed",
-        type=int,
-        default=42,
-        help="The seed value for reproducibility.",
-    )
-    parser.add_argument(
-        "--config",
-        type=str,
-        default="ustgcn",
-        help="The config to use.",
-    )
-
-    parser.add_argument(
-        "--mode",
-        type=str,
-        default="train",
-        help="The mode to use.",
-    )
-
-    args = parser.parse_args()
-
+def run(rank: int, world_size: int, args: argparse.Namespace) -> None:
+    """
+    Train or test the model in a single process.
+
+    :param rank: The rank of this process.
+    :type rank: int
+    :param world_size: The number of training processes.
+    :type world_size: int
+    :param args: The command line arguments.
+    :type args: argparse.Namespace
+    """
     set_seed(args.seed)
+    # allow TF32 matmuls on Ampere+ GPUs
+    torch.set_float32_matmul_precision("high")
 
     config = load_config(args.config)
 
+    device = torch.device(config["exp_params"]["device"])
+    if world_size > 1:
+        os.environ.setdefault("MASTER_ADDR", "localhost")
+        os.environ.setdefault("MASTER_PORT", "29500")
+        dist.init_process_group("nccl", rank=rank, world_size=world_size)
+        torch.cuda.set_device(rank)
+        device = torch.device("cuda", rank)
+
     data_center = DataCenter()
     data_loader = DataLoader(
         config["data_params"]["adj_path"],
@@ -104,11 +104,13 @@ if __name__ == "__main__":
         config["exp_params"]["num_gnn_layers"],
         config["exp_params"]["epochs"],
         config["exp_params"]["learning_rate"],
-        config["exp_params"]["batch_size"],
-        torch.device(config["exp_params"]["device"]),
+        device,
         config["logging_params"]["work_dir"],
         config["data_params"]["dish_dict_path"],
         config["data_params"]["dates_dict_path"],
+        config["exp_params"]["time_batch_size"],
+        config["exp_params"]["compile"],
+        config["exp_params"]["amp_dtype"],
     )
 
     if args.mode == "train":
@@ -122,3 +124,44 @@ if __name__ == "__main__":
         )
     else:
         raise ValueError("Invalid mode.")
+
+    if world_size > 1:
+        dist.destroy_process_group()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=42,
+        help="The seed value for reproducibility.",
+    )
+    parser.add_argument(
+        "--config",
+        type=str,
+        default="ustgcn",
+        help="The config to use.",
+    )
+
+    parser.add_argument(
+        "--mode",
+        type=str,
+        default="train",
+        help="The mode to use.",
+    )
+    parser.add_argument(
+        "--world_size",
+        type=int,
+        default=1,
+        help="The number of GPUs to train on with DDP.",
+    )
+
+    args = parser.parse_args()
+
+    if args.world_size > 1:
+        if args.mode != "train":
+            raise ValueError("Only training supports multiple processes.")
+        mp.spawn(run, args=(args.world_size, args), nprocs=args.world_size)
+    else:
+        run(0, 1, args)
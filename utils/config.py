@@ -21,7 +21,9 @@ ustgcn_config = {
         "num_gnn_layers": 3,
         "epochs": 500,
         "learning_rate": 0.001,
-        "batch_size": 256,
+        "time_batch_size": 8,
+        "compile": True,
+        "amp_dtype": "bfloat16",
         "test_model_path": os.path.join(
             os.getcwd(),
             'logs',
@@ -6,6 +6,7 @@ Functions:
     - :py:function:`rmse` calculates root mean squared error.
     - :py:function:`mape` calculates mean absolute percentage error.
     - :py:function:`mae` calculates mean absolute error.
+    - :py:function:`compute_metrics` calculates RMSE, MAE and MAPE at once.
 """
 
 __author__ = "Mir Sazzat Hossain"
@@ -69,23 +70,53 @@ def mae(y_true: list, y_pred: list) -> ndarray:
     return np.mean(np.abs(y_true - y_pred))
 
 
+def compute_metrics(y_true: list, y_pred: list) -> tuple:
+    """
+    Calculate RMSE, MAE and MAPE from a single difference array.
+
+    :param y_true: true values of shape (batch_size, out_size)
+    :type y_true: list
+    :param y_pred: predicted values of shape (batch_size, out_size)
+    :type y_pred: list
+
+    :return: RMSE, MAE, MAPE
+    :rtype: tuple
+    """
+    y_true = np.asarray(y_true)
+    y_pred = np.asarray(y_pred)
+    epsilon = 1e-7
+
+    diff = y_true - y_pred
+    abs_diff = np.abs(diff)
+
+    return (
+        np.sqrt(np.mean(diff * diff)),
+        np.mean(abs_diff),
+        np.mean(abs_diff / np.abs(y_true + epsilon)) * 100,
+    )
+
+
 def calculate_foodwise_errors(
-        y_true: list, y_pred: list, num_foods: int) -> list:
+        y_true: list, y_pred: list, num_foods: int) -> tuple:
     """
-    Calculate RMSE, MSE for each food item.
+    Calculate RMSE, MAE for each food item.
 
-    :param y_true: true values of shape (num_food*num_batches, out_size)
+    :param y_true: true values of shape (num_batches*num_food, out_size)
     :type y_true: list
-    :param y_pred: predicted values of shape (num_food*num_batches, out_size)
+    :param y_pred: predicted values of shape (num_batches*num_food, out_size)
     :type y_pred: list
+    :param num_foods: number of food items
+    :type num_foods: int
 
-    :return: RMSE, MSE for each food item
+    :return: RMSE, MAE for each food item
+    :rtype: tuple
     """
-    rmse_list = []
-    mse_list = []
+    y_true = np.asarray(y_true)
+    y_pred = np.asarray(y_pred)
+    out_size = y_true.shape[-1]
 
-    for i in range(num_foods):
-        rmse_list.append(rmse(y_true[i::num_foods], y_pred[i::num_foods]))
-        mse_list.append(mae(y_true[i::num_foods], y_pred[i::num_foods]))
+    diff = (y_true - y_pred).reshape(-1, num_foods, out_size)
+    rmse_list = np.sqrt(np.mean(np.square(diff), axis=(0, 2)))
+    mae_list = np.mean(np.abs(diff), axis=(0, 2))
 
-    return rmse_list, mse_list
+    return rmse_list, mae_list